@@ -1,10 +1,16 @@
 '''Find all xpath expressions on XML document'''
 
 
-from collections import OrderedDict
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from glob import glob
 from io import StringIO
+from itertools import islice
 from os import path, devnull, strerror
-from typing import Dict, List, Tuple
+from typing import AbstractSet, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import errno
 import sys
 
@@ -15,11 +21,82 @@ XPATH_REALLY_ALL = f'{XPATH_ALL} | //processing-instruction() | //comment()'
 WITH_COUNT = False
 MAX_ITEMS = 100000
 OUT_FD = sys.stdout
+# events to read namespace declarations, see _iter_declarations()
+_NS_EVENTS = ('start-ns', 'end-ns', 'start')
+# qualified xpaths up to this length are interned
+_INTERN_MAX_LEN = 200
 modes = ['xpath', 'all', 'raw', 'values']
 
+class XMap(Mapping):
+    '''Xpath expressions found on a document, in document order.
+    A read only mapping with unqualified xpath as keys and a tuple of
+        (qualified xpath, count of elements, attribute names)
+    as values, stored as parallel lists for lower memory usage:
+        xmap.unq[i], xmap.qual[i], xmap.counts[i], xmap.attrs[i]
+    Unlike dict, equality takes document order into account.'''
+    
+    __slots__ = ('index', 'unq', 'qual', 'counts', 'attrs')
+    
+    def __init__(self) -> None:
+        self.index: Dict[str, int] = {}
+        self.unq: List[str] = []
+        self.qual: List[str] = []
+        self.counts: array = array('i')
+        self.attrs: List[Optional[Tuple[str, ...]]] = []
+    
+    def add(self, xp: str, qxp: str, attrs: Optional[Tuple[str, ...]], count: int = 0) -> None:
+        '''Add a new xpath expression'''
+        self.index[xp] = len(self.unq)
+        self.unq.append(xp)
+        self.qual.append(qxp)
+        self.counts.append(count)
+        self.attrs.append(attrs)
+    
+    def __getitem__(self, xp: str) -> Tuple[str, int, Optional[Tuple[str, ...]]]:
+        i = self.index[xp]
+        return (self.qual[i], self.counts[i], self.attrs[i])
+    
+    def __contains__(self, xp: object) -> bool:
+        return xp in self.index
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.unq)
+    
+    def __len__(self) -> int:
+        return len(self.unq)
+    
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, XMap):
+            return (self.unq == other.unq and self.qual == other.qual
+                    and self.counts == other.counts and self.attrs == other.attrs)
+        return super().__eq__(other)
+    
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())})"
+
+def _xml_parser() -> etree.XMLParser:
+    '''Parser used for documents read by this module.
+    Size limits are lifted to support big documents. Whitespace text nodes
+    are kept, they can be selected by xpath_base, e.g.: //*[text()], and
+    are part of the string value of the returned tree.'''
+    return etree.XMLParser(huge_tree=True)
+
+@lru_cache(maxsize=4096)
+def _compile(expr: str, nsmap_items: Tuple[Tuple[str, str], ...]) -> etree.XPath:
+    '''Compile an xpath expression once for a given namespaces map.
+    nsmap_items is a hashable form of the namespaces dictionary:
+        tuple(sorted(nsmap.items()))'''
+    return etree.XPath(expr, namespaces=dict(nsmap_items))
+
+def clear_xpath_cache():
+    '''Clear the cache of compiled xpath expressions.
+    Expressions like xpath_base are compiled once per namespaces map and
+    reused by later calls to parse() or fromstring().'''
+    _compile.cache_clear()
+
 def usage():
     helpstr='''
-    pyxml2xpath <file path> [mode] [initial xpath expression] [with element count: yes|true] [max elements: int] [no banner: yes|true]
+    pyxml2xpath <file path or glob pattern> [mode] [initial xpath expression] [with element count: yes|true] [max elements: int] [no banner: yes|true]
     
     mode: str
         path  : print elements xpath expressions (default)
@@ -31,6 +108,10 @@ def usage():
         Start at some element defined by an xpath expression.
         //*[local-name()= "act"]
     
+    File path: str
+        A glob pattern, quoted, processes every matching file in parallel processes.
+        'tests/resources/*.xml'
+    
     Examples:
         pyxml2xpath tests/resources/soap.xml
 
@@ -47,71 +128,229 @@ def usage():
     '''
     print(helpstr)
 
-def _get_qualified_name(qname, revns):
-    '''Get qualified name as <prefix>:<local-name>'''
-    lname = qname.localname
-    if revns.get(qname.namespace) is not None:
-        lname = f"{revns.get(qname.namespace)}:{qname.localname}"
+def _get_qualified_name(tag: str, revns: Dict[str, str]) -> str:
+    '''Get qualified name as <prefix>:<local-name> from an element tag
+    in Clark notation, {namespace URI}local-name, without building an
+    etree.QName object.'''
+    uri, sep, lname = tag.rpartition('}')
+    if sep:
+        prefix = revns.get(uri[1:])
+        if prefix is not None:
+            return f"{prefix}:{lname}"
     return lname
 
-def _get_dict_list_value(value, element):
-    '''Initialize tuple for xpath dictionary values.
-    Items:
-        0) qualified xpath
-        1) count of elements found using the latter
-        2) list of element's attribute names
-    '''
+def _qualified_name_getter(revns: Dict[str, str]) -> Callable[[str], str]:
+    '''Return a function to get qualified name from an element tag.
+    Names are cached by tag since a document uses a small set of them.'''
+    
+    cache: Dict[str, str] = {}
+    def qualified_name(tag: str) -> str:
+        lname = cache.get(tag)
+        if lname is None:
+            lname = cache[tag] = sys.intern(_get_qualified_name(tag, revns))
+        return lname
+    return qualified_name
+
+def _intern_path(qxp: str) -> str:
+    '''Intern a qualified xpath. Siblings with the same qualified name
+    share their qualified xpath so xmap keeps a single copy of it. Very
+    long paths are left alone to keep the intern table small.'''
+    return sys.intern(qxp) if len(qxp) <= _INTERN_MAX_LEN else qxp
+
+def _attribute_names_getter() -> Callable[[etree._Element], Tuple[str, ...]]:
+    '''Return a function to get attribute names of an element as a tuple.
+    Elements with the same attribute names share the same tuple.'''
     
-    # Add attributes names to current xmap value
-    return (value, 0, [*element.keys()])
+    cache: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+    def attribute_names(element: etree._Element) -> Tuple[str, ...]:
+        names = tuple(element.keys())
+        return cache.setdefault(names, names)
+    return attribute_names
 
-def _build_path_from_parts(xmap, xp, qname, revns, ele):
-    '''Split path on unnamed elements and build qualified xpath
-        /soap:root/soap:xpath/*[1]
+def _qualify_from_ancestors(ele: etree._Element, qualified_name: Callable[[str], str]) -> str:
+    '''Build qualified xpath of an element from its ancestors' names
+        /*/*[1]
     could be converted to
-        /soap:root/soap:xpath/ns:someelement[1]
+        /ns98:root/ns98:someelement
     
     Parameters
     ----------
     
-    xmap: dict
-        xpath expressions dictionary
-    xp:   str
-        unqualified xpath (source)
-    qname: QName
-        element's qualfied name object
+    ele: etree._Element
+        current element
+    qualified_name: function
+        element tag to qualified name, see _qualified_name_getter()'''
+    
+    parts = [qualified_name(a.tag) for a in reversed([*ele.iterancestors()])]
+    parts.append(qualified_name(ele.tag))
+    return "/" + "/".join(parts)
+
+def _node_step(node: etree._Element) -> Optional[Tuple[str, Optional[str]]]:
+    '''Return (step, key) of a node's path the same way libxml2's
+    xmlGetNodePath() builds them, or None for other node types (e.g. entities).
+    - element in default namespace: *, key is None since it is indexed by its
+      position among all element siblings
+    - element with prefix or without namespace: name
+    - comment(), processing-instruction('target')
+    Siblings sharing a key are indexed: name[n]'''
+    
+    tag = node.tag
+    if type(tag) is str:
+        if tag[0] != '{':
+            return tag, tag
+        if node.prefix is None:
+            return '*', None
+        step = f"{node.prefix}:{tag[tag.index('}') + 1:]}"
+        return step, step
+    if tag is etree.Comment:
+        return 'comment()', 'comment()'
+    if tag is etree.PI:
+        step = f"processing-instruction('{node.target}')"
+        return step, step
+    return None
+
+def _iter_sibling_paths(parent_xp: str, nodes: Iterable[etree._Element]) -> Iterator[Tuple[str, etree._Element]]:
+    '''Yield (path, node) tuples for sibling nodes so result matches
+    tree.getpath(node). Index is omitted when there is no other sibling with
+    the same key.'''
+    
+    steps: List[Tuple[etree._Element, str, Optional[str]]] = []
+    totals: Dict[Optional[str], int] = {}
+    for node in nodes:
+        step_key = _node_step(node)
+        if step_key is None:
+            continue
+        key = step_key[1]
+        if type(node.tag) is str:
+            # every element takes a position among element siblings
+            totals[None] = totals.get(None, 0) + 1
+        if key is not None:
+            totals[key] = totals.get(key, 0) + 1
+        steps.append((node, *step_key))
+    
+    seen: Dict[Optional[str], int] = {}
+    for node, step, key in steps:
+        if type(node.tag) is str:
+            seen[None] = seen.get(None, 0) + 1
+        if key is not None:
+            seen[key] = seen.get(key, 0) + 1
+        if totals[key] > 1:
+            yield f"{parent_xp}/{step}[{seen[key]}]", node
+        else:
+            yield f"{parent_xp}/{step}", node
+
+def _iter_paths(tree: etree._ElementTree, with_others: bool = False) -> Iterator[Tuple[str, etree._Element]]:
+    '''Walk the whole document once in document order and yield (path, node)
+    tuples. Paths are built incrementally from parent's path, the same
+    string tree.getpath(node) would return but without walking ancestors
+    and siblings for each node.
+    
+    Parameters
+    ----------
+    tree: lxml.etree._ElementTree
+        ElementTree from current document
+    with_others: bool
+        also yield comments and processing instructions'''
+    
+    root = tree.getroot()
+    top = [*reversed([*root.itersiblings(preceding=True)]), root, *root.itersiblings()]
+    stack = [_iter_sibling_paths('', top)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        xp, node = item
+        if type(node.tag) is str:
+            yield item
+            if len(node):
+                stack.append(_iter_sibling_paths(xp, node))
+        elif with_others:
+            yield item
+
+def _iter_selection_paths(tree: etree._ElementTree, nodes: Iterable[etree._Element]) -> Iterator[Tuple[str, etree._Element]]:
+    '''Yield (path, node) tuples for nodes selected by an xpath expression.
+    Paths of all children of a parent are built at once and cached by
+    parent, so tree.getpath() is never called for a node with a parent.
+    getpath() counts siblings on every call which is quadratic for
+    selections of many siblings.'''
+    
+    children_paths: Dict[etree._Element, Dict[etree._Element, str]] = {}
+    for node in nodes:
+        # ancestors whose children paths are not known yet, nearest first
+        pending = []
+        prnt = node.getparent()
+        while prnt is not None and prnt not in children_paths:
+            pending.append(prnt)
+            prnt = prnt.getparent()
+        for anc in reversed(pending):
+            grand = anc.getparent()
+            anc_xp = children_paths[grand][anc] if grand is not None else tree.getpath(anc)
+            children_paths[anc] = {n: xp for xp, n in _iter_sibling_paths(anc_xp, anc)}
+        prnt = node.getparent()
+        yield (children_paths[prnt][node] if prnt is not None else tree.getpath(node)), node
+
+def _count_qualified(tree: etree._ElementTree, revns: Dict[str, str], relative: AbstractSet[str] = frozenset()) -> Counter:
+    '''Count nodes of the whole document by their absolute qualified xpath
+    in a single walk. Qualified xpaths are built the same way as
+    parse_mixed_ns() does when parsing the whole document so
+        counts[xmap[xp][0]]
+    is the number of nodes found with that qualified expression.
+    
+    Relative expressions made of qualified names only, e.g.: //ns98:entry/ns98:act,
+    can be counted in the same walk by matching the last names of each
+    element's path.
+    
+    Parameters
+    ----------
+    tree: lxml.etree._ElementTree
+        ElementTree from current document
     revns: dict
         namespace reverse map - URI to prefix.
-    ele: etree._ElementTree
-        current element'''
-    
-    parts = [p for p in xp.split("/*")]
-    last = parts[0]
-    if xp == '/*':
-        xmap[xp] = _get_dict_list_value(f"/{_get_qualified_name(qname, revns)}", ele)
-    for p in parts[1:]:
-        if f'{last}/*{p}' not in xmap:
-            xval = f'{xmap.get(last) or ""}/{_get_qualified_name(qname, revns)}'
-            xmap[xp] = _get_dict_list_value(xval, ele)
-            last = xp
-        elif xp[-1] not in ['*', ']']:
-            last = xp.split(']/')[0] + ']'
-            xval = f'{xmap.get(last) or ""}/{_get_qualified_name(qname, revns)}'
-            xmap[xp] = _get_dict_list_value(xval, ele)
-        elif f'{last}/*{p}' in xmap:
-            last = f'{last}/*{p}'
+    relative: set
+        relative expressions to count'''
+    
+    counts: Counter = Counter()
+    qxpaths: Dict[str, str] = {}
+    qualified_name = _qualified_name_getter(revns)
+    # number of names of relative expressions: //a/b -> 2
+    lengths = {r.count('/') - 1 for r in relative}
+    depth = max(lengths, default=0)
+    names: Dict[str, Tuple[str, ...]] = {}
+    for xp, node in _iter_paths(tree, True):
+        if type(node.tag) is not str:
+            counts[xp] += 1
+            continue
+        xpp = xp[:xp.rindex('/')]
+        qxp = xp
+        if '*' in xp:
+            qxp = f"{qxpaths.get(xpp, '')}/{qualified_name(node.tag)}"
+        counts[qxp] += 1
+        if depth:
+            # last qualified names of element's path
+            enames = (*names.get(xpp, ()), qualified_name(node.tag))[-depth:]
+            for n in lengths:
+                if n <= len(enames):
+                    rxp = '//' + '/'.join(enames[-n:])
+                    if rxp in relative:
+                        counts[rxp] += 1
+            if len(node):
+                names[xp] = enames
+        if len(node):
+            qxpaths[xp] = qxp
+    return counts
 
 def parse_mixed_ns(tree: etree._ElementTree,
-                   nsmap: Dict,
+                   nsmap: Dict[str, str],
                    xpath_base: str = XPATH_ALL,
                    *,
                    with_count: bool = WITH_COUNT, 
-                   max_items: int = MAX_ITEMS) -> OrderedDict[str, Tuple[str, int, List[str]]]:
+                   max_items: int = MAX_ITEMS) -> Optional[XMap]:
     '''Parse XML document that may contain anonymous namespace.
     Returns a dict with original xpath as keys, xpath with qualified names and
     count of elements found with the latter or None if an error occurred.
         xmap = {
-            "/some/xpath/*[1]": ("/some/xpath/ns:ele1", 1, ["id", "class"])
+            "/some/xpath/*[1]": ("/some/xpath/ns:ele1", 1, ("id", "class"))
         }
     To get the qualified xpath:
         xmap['/some/xpath/*[1]'][0]
@@ -130,32 +369,42 @@ def parse_mixed_ns(tree: etree._ElementTree,
         max number of elements to parse. Default: 100000'''
     
     revns = {v:k or 'ns' for k,v in nsmap.items()}
-    elements = tree.xpath(xpath_base, namespaces=nsmap)
+    qualified_name = _qualified_name_getter(revns)
+    attribute_names = _attribute_names_getter()
+    nskey = tuple(sorted(nsmap.items()))
 
-    xmap = None
-    try:
-        xmap = OrderedDict.fromkeys(map(tree.getpath, elements[:max_items]))
-    except TypeError as t:
-        if "_ElementUnicodeResult" in t.args[0]:
-            print(f"ERROR. Finding xpath expressions for text() nodes is not supported.\nxpath_base: {xpath_base}\nMessage: {t.args[0]}", file=sys. stderr)
-        else:
-            print(f"ERROR. Unexpected node type error. Please, file a bug.\n{t.args[0]}", file=sys. stderr)
-        return None
-    except Exception:
-        print("ERROR. Unexpected error. Please, file a bug.\n", file=sys. stderr)
-        import traceback
-        traceback.print_exc()
-        return None
-
-    for idx, xp in enumerate(xmap.keys()):
-        ele = elements[idx]
-        
+    if xpath_base in (XPATH_ALL, XPATH_REALLY_ALL):
+        # whole document: build paths in a single walk
+        xpaths = islice(_iter_paths(tree, xpath_base == XPATH_REALLY_ALL), max_items)
+    else:
+        elements = _compile(xpath_base, nskey)(tree)
+        if not isinstance(elements, list):
+            print(f"ERROR. Unexpected node type error. Please, file a bug.\nxpath_base: {xpath_base}\nResult type: {type(elements).__name__}", file=sys. stderr)
+            return None
+        other = next((e for e in elements if not isinstance(e, etree._Element)), None)
+        if isinstance(other, etree._ElementUnicodeResult):
+            print(f"ERROR. Finding xpath expressions for text() nodes is not supported.\nxpath_base: {xpath_base}", file=sys. stderr)
+            return None
+        elif other is not None:
+            print(f"ERROR. Unexpected node type error. Please, file a bug.\nxpath_base: {xpath_base}\nNode type: {type(other).__name__}", file=sys. stderr)
+            return None
+        xpaths = _iter_selection_paths(tree, elements[:max_items])
+
+    xmap = XMap()
+    xmap_add = xmap.add
+    # element of each entry, to report expressions that find no elements
+    nodes: List[etree._Element] = []
+    keep_node = nodes.append if with_count else None
+    for xp, ele in xpaths:
+        if keep_node is not None:
+            keep_node(ele)
+        # a single substring test, str.find()/rfind() method calls are slower
         if '*' not in xp:
             # xpath expression is already qualified
             # e.g.: /soapenv:Envelope/soapenv:Body
             # or element does not have namespaces
             # e.g.: /root/child
-            xmap[xp]= _get_dict_list_value(xp, ele)
+            xmap_add(xp, xp, attribute_names(ele))
         else:
             # Element may contain qualified and unqualified parts
             # /soapenv:Envelope/soapenv:Body/*/*[2]
@@ -164,46 +413,81 @@ def parse_mixed_ns(tree: etree._ElementTree,
             if prnt is not None:
                 # type(ele): etree._Element
                 if type(ele.tag) is str:
-                    qname = etree.QName(ele.tag)
-                    pqname = etree.QName(prnt.tag)
-                    # parent's (unqualified) xpath
-                    xpp = tree.getpath(prnt)
+                    # parent's (unqualified) xpath, same as tree.getpath(prnt)
+                    xpp = xp[:xp.rindex('/')]
                     # parent of current element was already parsed so
                     # just append current qualified name
-                    if xpp in xmap:
-                        if xmap[xpp] is None:
-                            xmap[xpp]= _get_dict_list_value(f"//{_get_qualified_name(pqname, revns)}", ele)
-                        xmap[xp] = _get_dict_list_value(f'{xmap[xpp][0]}/{_get_qualified_name(qname, revns)}', ele)
+                    pidx = xmap.index.get(xpp)
+                    if pidx is not None:
+                        xmap_add(xp, _intern_path(f'{xmap.qual[pidx]}/{qualified_name(ele.tag)}'), attribute_names(ele))
                     else:
                         # element's parent exists but it's not present on xmap.
                         # Adding it as preceding current element but not to xmap.
                         prfx = '//'
                         if prnt == tree.getroot():
                             prfx = '/'
-                        xmap[xp] = _get_dict_list_value(f'{prfx}{_get_qualified_name(pqname, revns)}/{_get_qualified_name(qname, revns)}', ele)
+                        xmap_add(xp, _intern_path(f'{prfx}{qualified_name(prnt.tag)}/{qualified_name(ele.tag)}'), attribute_names(ele))
                 else:
                     # Unqualified xpath support for Comments and processing instructions.
                     # type(ele): etree._Comment or etree._ProcessingInstruction
-                    xmap[xp] = xp, 0, None
+                    xmap_add(xp, xp, None)
             else:
                 # Probably the first unqualified xpath. Has no parent and is not on xmap yet
                 #print(f"DEBUG: Parsing root: {xp}", file=sys. stderr)
-                _build_path_from_parts(xmap, xp, etree.QName(ele.tag), revns, ele)
+                xmap_add(xp, _qualify_from_ancestors(ele, qualified_name), attribute_names(ele))
             
-        # count elements found with these xpath expressions
-        if with_count:
+    # count elements found with these xpath expressions
+    if with_count:
+        qcounts: Dict[str, int]
+        if _unique_bindings(_iter_declarations(etree.iterwalk(tree, events=_NS_EVENTS))):
+            # xpath without unqualified parts is the unique path to the element
+            # e.g.: /soapenv:Envelope/soapenv:Body[2]
+            anonymous = []
+            for i, xp in enumerate(xmap.unq):
+                if '*' in xp:
+                    anonymous.append(i)
+                else:
+                    xmap.counts[i] = 1
+            if not anonymous:
+                return xmap
+            
+            if xpath_base in (XPATH_ALL, XPATH_REALLY_ALL) and len(xmap) < max_items:
+                # whole document was parsed, qualified expressions are already known
+                qcounts = Counter(xmap.qual)
+            else:
+                relative = {xmap.qual[i] for i in anonymous if xmap.qual[i].startswith('//')}
+                qcounts = _count_qualified(tree, revns, relative)
+        else:
+            # a URI with several prefixes or a redeclared prefix: qualified
+            # expressions may find other elements or none at all so all of
+            # them are counted with xpath.
+            anonymous = range(len(xmap))
+            qcounts = {}
+        errors: List[str] = []
+        for i in anonymous:
+            xp = xmap.unq[i]
+            qxp = xmap.qual[i]
             # Count of elements found with qualified expression
             # Should never be 0.
-            #print(f"DEBUG: {xp} {xmap[xp]}", file=sys. stderr)
-            xcount = int(tree.xpath(f"count({xmap[xp][0]})", namespaces=nsmap))
+            #print(f"DEBUG: {xp} {qxp}", file=sys. stderr)
+            xcount = qcounts.get(qxp)
+            if xcount is None:
+                # expression not found by walking the document
+                xcount = qcounts[qxp] = int(_compile(f"count({qxp})", nskey)(tree))
             if xcount == 0:
                 # no creo en brujas pero que las hay, las hay. xD
-                print(f"ERROR: 0 elements found with {xp}. Possibly due to this bug: https://gitlab.gnome.org/GNOME/libxml2/-/issues/715", file=sys. stderr)
-                print(f"       element path without parent: {tree.getelementpath(ele)}", file=sys. stderr)
-            xmap[xp] = xmap[xp][0], xcount, xmap[xp][2]
+                errors.append(f"ERROR: 0 elements found with {xp}. Possibly due to this bug: https://gitlab.gnome.org/GNOME/libxml2/-/issues/715")
+                node = nodes[i]
+                # comments and processing instructions have no element path
+                epath = tree.getelementpath(node) if type(node.tag) is str else xp
+                errors.append(f"       element path without parent: {epath}")
+            xmap.counts[i] = xcount
+        if errors:
+            sys.stderr.write("\n".join(errors))
+            sys.stderr.write("\n")
     return xmap
 
-def print_xpaths(xmap: Dict,
+def print_xpaths(xmap: Mapping,
                  mode: str ="path",
                  *,
                  out_fd = OUT_FD):
@@ -217,68 +501,272 @@ def print_xpaths(xmap: Dict,
     
     acount=0
     acountmsg=''
+    lines: List[str] = []
     
-    for unq_xpath, qual_xpath_lst in xmap.items():
-        if mode not in ['raw', 'values']:
-            print(qual_xpath_lst[0])
+    rows: Iterable[Tuple[str, Tuple]]
+    if isinstance(xmap, XMap):
+        rows = zip(xmap.unq, zip(xmap.qual, xmap.counts, xmap.attrs))
+    else:
+        rows = xmap.items()
+    for unq_xpath, qual_xpath_lst in rows:
+        if mode == "raw":
+            lines.append(f"{unq_xpath} {qual_xpath_lst}")
+        elif mode == "values":
+            lines.append(f"{qual_xpath_lst}")
+        else:
+            lines.append(qual_xpath_lst[0])
     
         if mode == "all":
             #Print xpath for attributes
-            if qual_xpath_lst[2] is not []:
-                for a in qual_xpath_lst[2]:
-                    print(f"{qual_xpath_lst[0]}/@{a}")
-                    acount += 1
-                acountmsg = f"Found {acount:3} xpath expressions for attributes\n"
-        if mode == "raw":
-            print(unq_xpath, qual_xpath_lst)
-        elif mode == "values":
-            print(qual_xpath_lst)
-            
-    print(f"\nFound {len(xmap.keys()):3} xpath expressions for elements\n{acountmsg}", file=out_fd)
+            if qual_xpath_lst[2]:
+                lines.extend(f"{qual_xpath_lst[0]}/@{a}" for a in qual_xpath_lst[2])
+                acount += len(qual_xpath_lst[2])
+    
+    if mode == "all":
+        acountmsg = f"Found {acount:3} xpath expressions for attributes\n"
+    if lines:
+        # single write instead of a print() call per line
+        sys.stdout.write("\n".join(lines))
+        sys.stdout.write("\n")
+    print(f"\nFound {len(xmap):3} xpath expressions for elements\n{acountmsg}", file=out_fd)
 
-def build_namespace_dict(tree: etree._ElementTree) ->  Dict[str, str]:
-    '''Build a namespaces dictionary with prefix for default namespaces.
-    If there are more than 1 default namespace, prefix will be incremental:
-    ns98, ns99 and so on.'''
+def _sanitize_namespaces(nslst: Iterable[Tuple[Optional[str], str]]) ->  Dict[str, str]:
+    '''Build a namespaces dictionary from (prefix, URI) tuples in document
+    order adding a prefix for default namespaces (None prefix).'''
     
-    nslst = tree.xpath('//namespace::*[name()!="xml"]')
     nsidx = 98
     ns = f'ns{nsidx}'
-    nsmap = {}
+    nsmap: Dict[str, str] = {}
+    # number of prefixes mapped to each URI, same as v in nsmap.values()
+    # without scanning them. A redeclared prefix releases its old URI.
+    uris: Counter = Counter()
+    def put(prefix: str, uri: str):
+        old = nsmap.get(prefix)
+        if old is not None:
+            uris[old] -= 1
+        nsmap[prefix] = uri
+        uris[uri] += 1
+    
     for k, v in nslst:
         if k is not None:
-            nsmap[k] = v
+            put(k, v)
             continue
-        elif (k is None and v in nsmap.values()) or (k is None and v == ''):
+        elif (k is None and uris[v] > 0) or (k is None and v == ''):
             continue
         elif k is None and ns in nsmap and nsmap[ns] == v:
             continue
         elif k is None and ns in nsmap and nsmap[ns] != v:
             nsidx += 1
             ns = f'ns{nsidx}'
-        nsmap[ns] = v
+        put(ns, v)
     return nsmap
 
+def _unique_bindings(nslst: Iterable[Tuple[Optional[str], str]]) -> bool:
+    '''Check that every prefix of a document is bound to a single URI and
+    every URI to a single prefix, the default namespace counting as one.
+    Only then an xpath without unqualified parts finds just the element it
+    was built from.'''
+    
+    prefixes: Dict[str, str] = {}
+    uris: Dict[str, Optional[str]] = {}
+    for k, v in nslst:
+        if v == '':
+            continue
+        if k is not None and prefixes.setdefault(k, v) != v:
+            return False
+        if uris.setdefault(v, k) != k:
+            return False
+    return True
+
+def _iter_declarations(events: Iterable[Tuple[str, Any]]) -> Iterator[Tuple[Optional[str], str]]:
+    '''Yield (prefix, URI) tuples of the namespaces in scope of each element
+    from start-ns, end-ns and start events, in the order of the namespace
+    axis, //namespace::*, for the same result in _sanitize_namespaces():
+    outermost declarations first and each element's own declarations from
+    last to first. The binding in scope last in document order wins.
+    
+    Elements with the same namespaces in scope as the previous one are
+    yielded twice at most, further repetitions do not change the result.'''
+    
+    # declarations of each element in scope with any
+    scopes: List[List[Tuple[Optional[str], str]]] = []
+    declared: List[Tuple[Optional[str], str]] = []
+    inscope: List[Tuple[Optional[str], str]] = []
+    repeats = 0
+    for event, item in events:
+        if event == 'start-ns':
+            declared.append((item[0] or None, item[1]))
+        elif event == 'end-ns':
+            # one event for each declaration of the closed element
+            scopes[-1].pop()
+            if not scopes[-1]:
+                scopes.pop()
+            repeats = 0
+        else:
+            if declared:
+                scopes.append(declared)
+                declared = []
+                repeats = 0
+            if repeats == 0:
+                seen = set()
+                inscope = []
+                for decls in reversed(scopes):
+                    for prefix, uri in decls:
+                        if prefix not in seen:
+                            seen.add(prefix)
+                            inscope.append((prefix, uri))
+                inscope.reverse()
+            if repeats < 2:
+                repeats += 1
+                yield from inscope
+
+def build_namespace_dict(tree: etree._ElementTree) ->  Dict[str, str]:
+    '''Build a namespaces dictionary with prefix for default namespaces.
+    If there are more than 1 default namespace, prefix will be incremental:
+    ns98, ns99 and so on.
+    Namespace declarations are read from start-ns events of a tree walk
+    instead of the namespace axis, which creates a node for each namespace
+    in scope of every element.'''
+    
+    return _sanitize_namespaces(_iter_declarations(etree.iterwalk(tree, events=_NS_EVENTS)))
+
+def _recorded_xpath_counter(records: List[Tuple], nsmap: Dict[str, str]) -> Callable[[str], int]:
+    '''Return a function to count the elements found by an absolute
+    qualified xpath, e.g.: /ns98:root/p:ele[2]/ns98:child, over the records
+    of a streamed document, like count() would do on its tree. Elements are
+    indexed by parent and (namespace URI, local name) so a step with [n]
+    finds the n-th child with that name, whatever prefix the document used.'''
+    
+    children: Dict[int, Dict[Tuple[Optional[str], str], List[int]]] = {}
+    for idx, record in enumerate(records):
+        uri, _, lname = record[5].rpartition('}')
+        children.setdefault(record[0], {}).setdefault((uri[1:] or None, lname), []).append(idx)
+    
+    cache: Dict[str, int] = {}
+    def count_xpath(qxp: str) -> int:
+        xcount = cache.get(qxp)
+        if xcount is not None:
+            return xcount
+        nodes = [-1]
+        for step in qxp[1:].split('/'):
+            name, _, index = step.partition('[')
+            prefix, sep, lname = name.rpartition(':')
+            uri = nsmap.get(prefix, '') if sep else None
+            found: List[int] = []
+            for node in nodes:
+                siblings = children.get(node, {}).get((uri, lname), [])
+                if index:
+                    pos = int(index[:-1])
+                    siblings = siblings[pos - 1:pos]
+                found.extend(siblings)
+            nodes = found
+            if not nodes:
+                break
+        xcount = cache[qxp] = len(nodes)
+        return xcount
+    return count_xpath
+
+def _parse_stream(file: str, *,
+                  with_count: bool = WITH_COUNT,
+                  max_items: int = MAX_ITEMS) -> Tuple[Dict[str, str], XMap]:
+    '''Find xpath expressions for all elements of a file read with
+    etree.iterparse so the whole tree is never built. Elements are cleared
+    as soon as they are closed, only their path step, tag and attribute
+    names are kept. Paths are built at the end of the document when all
+    sibling indexes are known.
+    Returns the sanitized namespaces map and the xpath dictionary as
+    parse_mixed_ns() does for XPATH_ALL.'''
+    
+    # namespace events for _iter_declarations(), without repeated start
+    # events past the two it uses from a run of elements in the same scope
+    nsevents: List[Tuple[str, Any]] = []
+    # (parent index, step, key, position, sibling totals, tag, attribute names)
+    records: List[Tuple[int, str, Optional[str], int, Dict[Optional[str], int], str, Tuple[str, ...]]] = []
+    attribute_names = _attribute_names_getter()
+    parents = [-1]
+    totals: List[Dict[Optional[str], int]] = [{}]
+    for event, item in etree.iterparse(file, events=('start-ns', 'end-ns', 'start', 'end'), huge_tree=True):
+        if event == 'start-ns':
+            nsevents.append((event, item))
+        elif event == 'end-ns':
+            nsevents.append((event, None))
+        elif event == 'start':
+            if len(nsevents) < 2 or nsevents[-1][0] != 'start' or nsevents[-2][0] != 'start':
+                nsevents.append((event, None))
+            step, key = _node_step(item)
+            sibling_totals = totals[-1]
+            sibling_totals[None] = sibling_totals.get(None, 0) + 1
+            if key is not None:
+                sibling_totals[key] = sibling_totals.get(key, 0) + 1
+            parents.append(len(records))
+            totals.append({})
+            records.append((parents[-2], step, key, sibling_totals[key], sibling_totals, item.tag, attribute_names(item)))
+        else:
+            parents.pop()
+            totals.pop()
+            # free memory of already processed elements
+            item.clear(keep_tail=True)
+            prnt = item.getparent()
+            if prnt is not None:
+                while item.getprevious() is not None:
+                    del prnt[0]
+    
+    nslst = list(_iter_declarations(nsevents))
+    nsmap = _sanitize_namespaces(nslst)
+    revns = {v:k or 'ns' for k,v in nsmap.items()}
+    qualified_name = _qualified_name_getter(revns)
+    unique = _unique_bindings(nslst)
+    xmap = XMap()
+    qcounts: Counter = Counter()
+    xpaths: List[Tuple[str, str]] = []
+    for idx, (pidx, step, key, pos, sibling_totals, tag, attrs) in enumerate(records):
+        if idx >= max_items and not (with_count and unique):
+            break
+        pxp, pqxp = xpaths[pidx] if pidx >= 0 else ('', '')
+        xp = f"{pxp}/{step}[{pos}]" if sibling_totals[key] > 1 else f"{pxp}/{step}"
+        qxp = xp
+        if '*' in xp:
+            qxp = _intern_path(f"{pqxp}/{qualified_name(tag)}")
+        xpaths.append((xp, qxp))
+        if unique:
+            qcounts[qxp] += 1
+        if idx < max_items:
+            xmap.add(xp, qxp, attrs)
+    if with_count:
+        if unique:
+            for i, (xp, qxp) in enumerate(zip(xmap.unq, xmap.qual)):
+                # xpath without unqualified parts is the unique path to the element
+                xmap.counts[i] = qcounts[qxp] if '*' in xp else 1
+        else:
+            # a URI with several prefixes or a redeclared prefix: qualified
+            # expressions may find other elements or none at all so they
+            # are evaluated over the recorded elements.
+            count_xpath = _recorded_xpath_counter(records, nsmap)
+            for i, qxp in enumerate(xmap.qual):
+                xmap.counts[i] = count_xpath(qxp)
+    return nsmap, xmap
+
 def fromstring(xmlstr: str, *,
                xpath_base: str = '//*',
                with_count: bool = WITH_COUNT,
-               max_items: int = MAX_ITEMS) -> (etree._ElementTree, Dict[str, str], OrderedDict[str, Tuple[str, int, List[str]]]):
-    doc = etree.parse(StringIO(xmlstr))
+               max_items: int = MAX_ITEMS) -> Tuple[Optional[etree._ElementTree], Dict[str, str], Optional[XMap]]:
+    doc = etree.parse(StringIO(xmlstr), parser=_xml_parser())
     return parse(file=None, itree=doc, xpath_base=xpath_base, with_count=with_count, max_items=max_items)
     
-def parse(file: str, *,
-          itree: etree._ElementTree = None,
+def parse(file: Optional[str], *,
+          itree: Optional[etree._ElementTree] = None,
           xpath_base: str = XPATH_ALL,
           with_count: bool = WITH_COUNT,
-          max_items: int = MAX_ITEMS) -> (etree._ElementTree, Dict[str, str], OrderedDict[str, Tuple[str, int, List[str]]]):
+          max_items: int = MAX_ITEMS,
+          streaming: bool = False) -> Tuple[Optional[etree._ElementTree], Dict[str, str], Optional[XMap]]:
     '''Parse given xml file, find xpath expressions in it and return
     - The ElementTree for further usage
     - The sanitized namespaces map (no None keys)
     - A dictionary with original xpath as keys, and parsed xpaths, count of elements found with them and names of attributes of that elements:
     
     xmap = {
-        "/some/xpath/*[1]": ( "/some/xpath/ns:ele1", 1, ["id", "class"] ),
-        "/some/other/xpath/*[3]": ( "/some/other/xpath/ns:other", 1, ["attr1", "attr2"] ),
+        "/some/xpath/*[1]": ( "/some/xpath/ns:ele1", 1, ("id", "class") ),
+        "/some/other/xpath/*[3]": ( "/some/other/xpath/ns:other", 1, ("attr1", "attr2") ),
     }
     
     Parameters
@@ -289,24 +777,70 @@ def parse(file: str, *,
         xpath_base: xpath expression to start searching xpaths for.
         with_count: Include count of elements found with each expression. Default: False
         max_items: limit the number of parsed elements. Default: 100000
+        streaming: read file with iterparse without keeping the whole document in memory.
+                Only supported for files and xpath_base='//*'. Returned ElementTree is None.
     '''
     
     try:
-        tree = itree
-        if tree is None:
-            if not path.isfile(file):
-                raise FileNotFoundError(errno.ENOENT, strerror(errno.ENOENT), file)
-            with open(file, "r") as fin:
-                tree = etree.parse(fin)
-        
-        nsmap = build_namespace_dict(tree)
-        #print(f"Namespaces found: {nsmap}")
-        xmap = parse_mixed_ns(tree, nsmap, xpath_base, with_count=with_count, max_items=max_items)
-        return (tree, nsmap, xmap)
+        return _parse(file, itree=itree, xpath_base=xpath_base, with_count=with_count, max_items=max_items, streaming=streaming)
     except Exception as e:
         print("ERROR.", type(e).__name__, "–", e, file=sys.stderr)
         raise(e)
 
+def _parse(file: Optional[str], *,
+           itree: Optional[etree._ElementTree] = None,
+           xpath_base: str = XPATH_ALL,
+           with_count: bool = WITH_COUNT,
+           max_items: int = MAX_ITEMS,
+           streaming: bool = False) -> Tuple[Optional[etree._ElementTree], Dict[str, str], Optional[XMap]]:
+    '''parse() without printing errors, see parse().'''
+    
+    tree = itree
+    if tree is None:
+        if not path.isfile(file):
+            raise FileNotFoundError(errno.ENOENT, strerror(errno.ENOENT), file)
+        if streaming:
+            if xpath_base != XPATH_ALL:
+                raise ValueError(f"streaming is only supported with xpath_base='{XPATH_ALL}': {xpath_base}")
+            nsmap, xmap = _parse_stream(file, with_count=with_count, max_items=max_items)
+            return (None, nsmap, xmap)
+        with open(file, "r") as fin:
+            tree = etree.parse(fin, parser=_xml_parser())
+    
+    nsmap = build_namespace_dict(tree)
+    #print(f"Namespaces found: {nsmap}")
+    xmap = parse_mixed_ns(tree, nsmap, xpath_base, with_count=with_count, max_items=max_items)
+    return (tree, nsmap, xmap)
+
+def _parse_file(file: str, kwargs: Dict[str, Any]) -> Tuple[Optional[Dict[str, str]], Optional[XMap]]:
+    '''Worker for parse_many(). ElementTree objects can not be pickled so only
+    namespaces map and xmap are sent back to the calling process.
+    Errors are reported here with the file name since lxml exceptions
+    like XMLSyntaxError can not be pickled either.'''
+    try:
+        return _parse(file, **kwargs)[1:]
+    except Exception as e:
+        print(f"ERROR. {file}: {type(e).__name__} – {e}", file=sys.stderr)
+        return (None, None)
+
+def parse_many(files: Iterable[str], *, workers: Optional[int] = None, **kwargs) -> List[Tuple[Optional[Dict[str, str]], Optional[XMap]]]:
+    '''Parse several files in parallel processes.
+    
+    Returns a list of (nsmap, xmap) tuples in the same order as files.
+    A file that could not be parsed gets (None, None), its error is
+    printed to stderr and the other files are still parsed.
+    
+    Parameters
+    ----------
+        files: file path strings
+        workers: max number of processes. Default: number of CPUs
+        kwargs: keyword arguments for parse(), except itree.
+    '''
+    
+    files = list(files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_parse_file, files, [kwargs] * len(files)))
+
 def main():
     if sys.argv[1] in ["-h", "--help"]:
         usage()
@@ -321,9 +855,13 @@ def main():
     no_banners = False
     warns = None
     
-    if not path.isfile(file):
+    files = [file] if path.isfile(file) else sorted(f for f in glob(file) if path.isfile(f))
+    if not files:
         print(f"[Errno {errno.ENOENT}] {strerror(errno.ENOENT)}", file=sys.stderr)
         sys.exit(errno.ENOENT)
+    if len(files) == 1:
+        # glob pattern matching a single file
+        file = files[0]
     
     for i, arg in enumerate(sys.argv):
         if str(arg).lower() in ['', 'none']:
@@ -357,11 +895,21 @@ def main():
     print(f"{'no_banners':10}: {no_banners}", file=out_fd, flush=True)
     if warns is not None:
         print(f"\n{warns}\n", file=sys.stderr)
-    nsmap, xmap = parse(file,  xpath_base=xpath_base, with_count=with_count, max_items=max_items)[1:]
-    if xmap is not None:
-        print(f"namespaces: {nsmap}\n", file=out_fd, flush=True)
-        print_xpaths(xmap, mode, out_fd=out_fd)
+    if len(files) == 1:
+        results = [parse(file,  xpath_base=xpath_base, with_count=with_count, max_items=max_items)[1:]]
     else:
+        results = parse_many(files,  xpath_base=xpath_base, with_count=with_count, max_items=max_items)
+    
+    failed = False
+    for file, (nsmap, xmap) in zip(files, results):
+        if len(files) > 1:
+            print(f"\n{'file':10}: {file}", file=out_fd, flush=True)
+        if xmap is not None:
+            print(f"namespaces: {nsmap}\n", file=out_fd, flush=True)
+            print_xpaths(xmap, mode, out_fd=out_fd)
+        else:
+            failed = True
+    if failed:
         sys.exit(1)
 
 if __name__ == "__main__":
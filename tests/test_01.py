@@ -1,4 +1,6 @@
 import glob
+import os
+import tempfile
 from xml2xpath import xml2xpath
 from lxml import html
 
@@ -126,4 +128,124 @@ class TestPyXml2Xpath01:
         xmap2 = xml2xpath.parse('resources/simple-ns-rev-order.xml')[2]
         
         assert xmap != xmap2
-
+    
+    def test_keys_match_getpath(self):
+        sample_paths = glob.glob('resources/*.xml')
+        print("")
+        for xfile in sample_paths:
+            print(f"Testing keys of '{xfile}'")
+            tree, nsmap, xmap = xml2xpath.parse(xfile, xpath_base=xml2xpath.XPATH_REALLY_ALL)
+            # keys built by walking the document must be the unqualified expressions returned by lxml
+            assert list(xmap.keys()) == [tree.getpath(n) for n in tree.xpath(xml2xpath.XPATH_REALLY_ALL)]
+            # keys of a selection
+            xpath_base = '//*[position() mod 2 = 0] | //comment()'
+            xmap = xml2xpath.parse(None, itree=tree, xpath_base=xpath_base)[2]
+            assert list(xmap.keys()) == [tree.getpath(n) for n in tree.xpath(xpath_base)]
+    
+    def test_parse_streaming(self):
+        sample_paths = glob.glob('resources/*.xml')
+        print("")
+        for xfile in sample_paths:
+            print(f"Testing streaming '{xfile}'")
+            tree, nsmap, xmap = xml2xpath.parse(xfile, with_count=True, streaming=True)
+            assert tree is None
+            # same result as parsing the whole tree
+            assert (nsmap, xmap) == tuple(xml2xpath.parse(xfile, with_count=True)[1:])
+    
+    def test_parse_many(self):
+        sample_paths = sorted(glob.glob('resources/*.xml'))
+        results = xml2xpath.parse_many(sample_paths, workers=2, with_count=True)
+        for xfile, result in zip(sample_paths, results):
+            assert result == tuple(xml2xpath.parse(xfile, with_count=True)[1:])
+        
+        # a malformed file does not stop the batch
+        with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as fout:
+            fout.write('<root><unclosed></root>')
+        try:
+            results = xml2xpath.parse_many(['resources/soap.xml', fout.name], workers=2)
+        finally:
+            os.unlink(fout.name)
+        assert results[0] == tuple(xml2xpath.parse('resources/soap.xml')[1:])
+        assert results[1] == (None, None)
+    
+    def test_xpath_cache(self):
+        filepath = 'resources/soap.xml'
+        xpath_base = '//*[local-name()="incident"]'
+        xml2xpath.clear_xpath_cache()
+        xmap = xml2xpath.parse(filepath, xpath_base=xpath_base)[2]
+        # same expression and namespaces, compiled expression is reused
+        xmap2 = xml2xpath.parse(filepath, xpath_base=xpath_base)[2]
+        
+        assert xmap == xmap2
+        assert xml2xpath._compile.cache_info().hits == 1
+        xml2xpath.clear_xpath_cache()
+        assert xml2xpath._compile.cache_info().currsize == 0
+    
+    def test_parse_keeps_blank_text(self):
+        # whitespace only text nodes are part of the tree
+        xmap = xml2xpath.parse('resources/soap.xml', xpath_base='//*[text()]')[2]
+        assert len(xmap) == 6
+        tree = xml2xpath.fromstring('<p><b>a</b> <i>b</i></p>')[0]
+        assert tree.xpath('string(/p)') == 'a b'
+    
+    def test_count_prefixed_unqualified_key(self):
+        # unqualified key uses a prefix redeclared below the root
+        xmlstr = '<p:root xmlns:p="urn:a"><a xmlns="urn:a"><b/><p:c xmlns:p="urn:c"/></a></p:root>'
+        xmap = xml2xpath.fromstring(xmlstr, xpath_base='/*/*', with_count=True)[2]
+        assert list(xmap.keys()) == ['/p:root/*']
+    
+    def test_namespaces_redeclared_prefix(self):
+        header = '<soapenv:Header><ns1:h xmlns:ns1="urn:A"/></soapenv:Header>'
+        body = '<soapenv:Body><ns1:r/></soapenv:Body>'
+        docs = [f'<soapenv:Envelope xmlns:soapenv="S" xmlns:ns1="urn:root">{header}{body}</soapenv:Envelope>',
+                f'<soapenv:Envelope xmlns:soapenv="S" xmlns:ns1="urn:root">{body}{header}</soapenv:Envelope>']
+        # binding in scope last in document order is kept
+        assert xml2xpath.fromstring(docs[0])[1] == {'ns1': 'urn:root', 'soapenv': 'S'}
+        assert xml2xpath.fromstring(docs[1])[1] == {'ns1': 'urn:A', 'soapenv': 'S'}
+        # default namespace declared after a prefix with the same URI
+        xmlstr = '<xs:schema xmlns:xs="X" xmlns="X"><xs:element/><element/></xs:schema>'
+        assert xml2xpath.fromstring(xmlstr)[1] == {'ns98': 'X', 'xs': 'X'}
+        
+        for xmlstr in [*docs, xmlstr]:
+            with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as fout:
+                fout.write(xmlstr)
+            try:
+                assert xml2xpath.parse(fout.name, streaming=True)[1] == xml2xpath.parse(fout.name)[1]
+            finally:
+                os.unlink(fout.name)
+    
+    def test_count_shared_and_redeclared_namespaces(self):
+        xsd = '<xs:schema xmlns:xs="X" xmlns="X"><xs:element/><element/></xs:schema>'
+        soap = ('<soapenv:Envelope xmlns:soapenv="S" xmlns:ns1="urn:root">'
+                '<soapenv:Header><ns1:h xmlns:ns1="urn:A"/></soapenv:Header>'
+                '<soapenv:Body><ns1:r/></soapenv:Body></soapenv:Envelope>')
+        # same URI as prefix and default namespace: both elements are found
+        xmap = xml2xpath.fromstring(xsd, with_count=True)[2]
+        assert xmap['/xs:schema/xs:element'][1] == 2
+        assert xmap['/xs:schema/*[2]'] == ('/xs:schema/xs:element', 2, ())
+        # redeclared prefix: qualified expression does not find the element
+        xmap = xml2xpath.fromstring(soap, with_count=True)[2]
+        assert xmap['/soapenv:Envelope/soapenv:Header/ns1:h'][1] == 0
+        assert xmap['/soapenv:Envelope/soapenv:Body/ns1:r'][1] == 1
+        
+        # repeated prefixed siblings under a default namespace parent
+        xsd_siblings = '<xs:schema xmlns:xs="X" xmlns="X"><element><xs:a/><xs:a/></element></xs:schema>'
+        xmap = xml2xpath.fromstring(xsd_siblings, with_count=True)[2]
+        assert xmap['/xs:schema/*/xs:a[1]'] == ('/xs:schema/xs:element/xs:a', 2, ())
+        assert xmap['/xs:schema/*/xs:a[2]'] == ('/xs:schema/xs:element/xs:a', 2, ())
+        # siblings with the same prefix bound to different URIs
+        rebound = '<b xmlns:q="urn:b"><q:a xmlns:q="urn:a"/><q:b/><q:a><b/></q:a></b>'
+        
+        for xmlstr in (xsd, soap, xsd_siblings, rebound):
+            with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as fout:
+                fout.write(xmlstr)
+            try:
+                assert xml2xpath.parse(fout.name, with_count=True, streaming=True)[2] == xml2xpath.parse(fout.name, with_count=True)[2]
+            finally:
+                os.unlink(fout.name)
+    
+    def test_count_comment_not_found(self):
+        # comment under an element its qualified xpath does not find
+        xmlstr = '<r xmlns:p="urn:b"><p:b xmlns:p="urn:a"><!--c--></p:b><p:a/></r>'
+        xmap = xml2xpath.fromstring(xmlstr, xpath_base=xml2xpath.XPATH_REALLY_ALL, with_count=True)[2]
+        assert xmap['/r/p:b/comment()'][1] == 0